@@ -1,18 +1,165 @@
 from abc import abstractmethod
+from dataclasses import dataclass, fields
+import itertools
+import math
+import queue
+import threading
+import weakref
 import torch
-import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import numpy as np
-from typing import Tuple
+from typing import Optional, Tuple
 from network import QNetwork, SmallQNetwork , VNetwork
 
+# Batch and observation shapes never change, so let cuDNN benchmark the conv algorithms once and reuse the
+# fastest one. The FC layers may use TF32 matmuls on Ampere and newer GPUs.
+# Benchmark mode is opt-in for experiments: main.py switches it off again for reproducible seeds
+# unless the config sets "deterministic": false, which none of the shipped configs do
+torch.backends.cudnn.benchmark = True
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+
+# TD losses are compiled as standalone functions so TorchInductor can fuse the forward passes with the
+# gather / max / masking / MSE epilogue. Batch shapes are fixed (batch_size), so they compile once.
+
+@torch.compile
+def _dqn_loss(q_net, tgt_net, states, actions, rewards, next_states, terminals, gamma):
+    q_s = q_net(states) # Shape: (batch_size, n_actions)
+
+    # Gather Q-values corresponding to the actions taken
+    q_action_taken = q_s.gather(1, actions.unsqueeze(1)).squeeze(1)
+
+    # Target needs no gradients, so the target network's activations are not kept around for backward
+    with torch.no_grad():
+        # Get Q-values for next states from target network
+        q_next = tgt_net(next_states) # Shape: (batch_size, n_actions)
+
+        #  For DQN, target is R + gamma * max_a'(Q_target(s', a')), Q-value of terminal state is 0
+        # [0] to get values from (values, indices) tuple, mask multiplied in so it fuses with the target
+        q_target = rewards + gamma * torch.max(q_next, dim=1)[0] * (~terminals).float()
+
+    return F.mse_loss(q_action_taken, q_target)
+
+@torch.compile
+def _ddqn_loss(q_net, tgt_net, states, actions, rewards, next_states, terminals, gamma):
+    q_s = q_net(states) # Shape: (batch_size, n_actions)
+
+    # Gather Q-values corresponding to the actions taken
+    q_action_taken = q_s.gather(1, actions.unsqueeze(1)).squeeze(1)
+
+    # The whole target needs no gradients, including the online network's next state forward
+    # that only feeds the argmax
+    with torch.no_grad():
+        q_snext = q_net(next_states) # Shape: (batch_size, n_actions)
+        # No terminal masking here: the chosen action does not matter for terminal rows
+        # since their target Q-value is zeroed below
+        q_actions = torch.argmax(q_snext, dim=1) # argmax actions in next state
+
+        target_q_snext = tgt_net(next_states) # shape (batch_size, n_actions)
+        # action target for double dqn
+        q_action_target = target_q_snext.gather(1, q_actions.unsqueeze(1)).squeeze(1)
+
+    # Q-value of terminal state is 0
+    target = rewards + gamma * q_action_target * (~terminals).float()
+
+    return F.mse_loss(q_action_taken, target)
+
+@torch.compile
+def _dqv_loss(q_net, v_net, tgt_v_net, states, actions, rewards, next_states, terminals, gamma):
+    # Calculate TD target for both V and Q networks
+    # target^DQV = r_t + gamma * V(s_{t+1}; Phi^-)
+    with torch.no_grad():
+        target = rewards + gamma * tgt_v_net(next_states).squeeze(1) * (~terminals).float()
+
+    # The two losses touch disjoint parameters and share a constant target,
+    # so backpropagating their sum gives each network exactly its own gradient
+    v_s = v_net(states).squeeze(1)
+    q_action_taken = q_net(states).gather(1, actions.unsqueeze(-1)).squeeze(-1)
+    return F.mse_loss(target, v_s) + F.mse_loss(target, q_action_taken)
+
+@torch.compile
+def _dqv_max_loss(q_net, v_net, tgt_q_net, states, actions, rewards, next_states, terminals, gamma):
+    v_s = v_net(states).squeeze(1) # Shape: (batch_size,)
+
+    with torch.no_grad():
+        # Target for V-network = r_t + gamma * max_a' Q(s_{t+1}, a'; theta^-)
+        v_target = rewards + gamma * torch.max(tgt_q_net(next_states), dim=1)[0] * (~terminals).float()
+
+        # Target for Q-network = r_t + gamma * V(s_{t+1}; Phi), with V before this step's update
+        v_snext = v_net(next_states).squeeze(1)
+        q_target = rewards + gamma * v_snext * (~terminals).float()
+
+    q_action_taken = q_net(states).gather(1, actions.unsqueeze(-1)).squeeze(-1)
+    return F.mse_loss(v_target, v_s) + F.mse_loss(q_target, q_action_taken)
+
+def _prefetch_batches(agent_ref, batch_queue, slots, generator, batch_size):
+    # Background loop filling the pinned staging slots in turn. Only a weak reference to the agent is
+    # held while waiting on the queue, so the thread exits once the agent is garbage collected.
+    # A failed gather is queued in place of the batch and ends the thread, _sample_batch re-raises it
+    for i in itertools.count():
+        agent = agent_ref()
+        if agent is None:
+            return
+        item = slots[i % len(slots)]
+        try:
+            agent._gather_pinned(item, batch_size, generator)
+        except Exception as error:
+            item = error
+        del agent
+
+        while True:
+            try:
+                batch_queue.put(item, timeout=1.0)
+                break
+            except queue.Full:
+                if agent_ref() is None:
+                    return
+        if isinstance(item, Exception):
+            return
+
+@dataclass
+class DQNConfig:
+    """!
+    Hyperparameters shared by all agents. The defaults are the DQN ones, agents override
+    them through their config_defaults.
+    """
+
+    learning_rate: float = 0.0001
+    gamma: float = 0.99
+    epsilon_start: float = 1.0
+    epsilon_min: float = 0.0001
+    epsilon_decay: float = 0.986
+    batch_size: int = 32
+    target_update_frequency: int = 1000
+    burn_in_period: int = 7000
+    replay_device: Optional[str] = None # device holding the memory buffer, defaults to the training device
+
+    @classmethod
+    def from_kwargs(cls, kwargs: dict, **defaults) -> "DQNConfig":
+        """!
+        Builds the config from agent keyword arguments, e.g. a loaded experiment config.
+        Keys that are not hyperparameters (experiment name, seeds, ...) are ignored.
+
+        @param kwargs (dict): Keyword arguments passed to the agent
+        @param defaults: Agent specific defaults, used for keys missing from kwargs
+
+        @return (DQNConfig): The agent's hyperparameters
+        """
+
+        names = {field.name for field in fields(cls)}
+        return cls(**{**defaults, **{key: value for key, value in kwargs.items() if key in names}})
+
 class Agent():
+    config_defaults = {}
+    epsilon_schedule_steps = 100_000 # Longest precomputed epsilon schedule, later steps fall back to _decay_epsilon
+
     def __init__(
         self,
         memory_size: int,
         state_dimensions: Tuple[int, int, int],
         n_actions: int,
+        **kwargs
     ) -> None:
         """!
         Initializes the agent.
@@ -24,17 +171,55 @@ class Agent():
         @param memory_size (int): Size of the memory buffer
         @param state_dimensions (int): Number of dimensions of the state space
         @param n_actions (int): Number of actions the agent can take
+        @param kwargs: Hyperparameters, see DQNConfig. Set replay_device to "cpu" when the
+                       memory buffer does not fit in GPU memory
         """
 
+        self.cfg = DQNConfig.from_kwargs(kwargs, **self.config_defaults)
+        self.epsilon = self.cfg.epsilon_start
+        self._epsilon_schedule = self._make_epsilon_schedule()
+        self.learn_step_counter = 0 # For target network updates
+
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.replay_device = torch.device(self.cfg.replay_device) if self.cfg.replay_device is not None else self.device
+
+        # By default the replay buffer lives on the training device, so learn() never has to copy batches host -> device
+        # Frames are resized pixel intensities in [0, 255], not integers: they are rounded to the nearest
+        # integer, stored as uint8 and cast to float only once sampled
+        # Rewards are stored as int8: they are truncated to integers and clipped to [-128, 127],
+        # which holds the per-step rewards of the Atari games
+        # There is no next state buffer: the next state of transition i is the state of transition i+1
         self.memory_size = memory_size
-        self.state_buffer = np.zeros((self.memory_size, *state_dimensions), dtype=np.float32)
-        self.next_state_buffer = np.zeros((self.memory_size, *state_dimensions), dtype=np.float32)
-        self.action_buffer = np.zeros(self.memory_size, dtype=np.int32)
-        self.reward_buffer = np.zeros(self.memory_size, dtype=np.float32)
-        self.terminal_buffer = np.zeros(self.memory_size, dtype=bool)  
+        self.state_buffer = torch.zeros((self.memory_size, *state_dimensions), dtype=torch.uint8, device=self.replay_device)
+        self.action_buffer = torch.zeros(self.memory_size, dtype=torch.int64, device=self.replay_device)
+        self.reward_buffer = torch.zeros(self.memory_size, dtype=torch.int8, device=self.replay_device)
+        self.terminal_buffer = torch.zeros(self.memory_size, dtype=torch.bool, device=self.replay_device)
         self.mem_counter = 0
         self.n_actions = n_actions
 
+        # Transitions headed for a GPU buffer are collected on the host and written in blocks,
+        # one host -> device copy per block instead of one per environment step
+        self._pending = []
+        self._pending_size = min(64, self.memory_size) if self.replay_device.type == "cuda" else 1
+
+        # Reused input tensor for the single observation forward in choose_action
+        self._obs_scratch = torch.empty((1, *state_dimensions), dtype=torch.float32, device=self.device)
+
+        # A host buffer feeding a GPU gathers batches into pinned staging tensors on a background thread,
+        # a few batches ahead of learn(), which then copies them to the GPU on a side stream.
+        # The thread and its staging tensors are created on the first sample, once the batch size is known
+        # The sampled batches depend on thread timing, so training on this path is not reproducible even when seeded
+        self._use_staging = self.replay_device.type == "cpu" and self.device.type == "cuda"
+        self._buffer_lock = threading.Lock() # keeps the prefetcher from gathering half-written transitions
+        self._batch_queue = queue.Queue(maxsize=2) if self._use_staging else None
+        self._prefetch_thread = None
+        self._copy_stream = torch.cuda.Stream() if self._use_staging else None
+
+        # On GPU the whole train step is captured once into a CUDA graph and replayed on static inputs
+        self._graph = None
+        self._graph_inputs = None
+        self._graph_warmup_steps = 0
+
 
     def store_transition(
         self,
@@ -45,13 +230,15 @@ class Agent():
         done: bool
     ) -> None:
         
-        index = self.mem_counter % self.memory_size # modulus to overwrite old transitions
-        self.state_buffer[index] = state
-        self.action_buffer[index] = action
-        self.reward_buffer[index] = reward
-        self.next_state_buffer[index] = new_state
-        self.terminal_buffer[index] = done
-        self.mem_counter += 1
+        # Network outputs must be detached before they are stored, a tensor still in an autograd graph
+        # would keep the whole graph alive for as long as the transition sits in the buffer
+        if torch.is_tensor(state):
+            assert not state.requires_grad and state.grad_fn is None, "detach tensors before storing them"
+            state = state.detach().cpu().numpy()
+
+        self._pending.append((np.rint(state).astype(np.uint8), action, int(np.clip(reward, -128, 127)), done))
+        if len(self._pending) == self._pending_size:
+            self._flush_pending()
         """!
         Stores the state transition for later memory replay.
         Make sure that the memory buffer does not exceed its maximum size.
@@ -59,145 +246,415 @@ class Agent():
         Hint: after reaching the limit of the memory buffer, maybe you should start overwriting
         the oldest transitions?
 
-        @param state        (list): Vector describing current state
+        @param state        (list): Vector describing current state, tensors must not require gradients
         @param action       (int): Action taken
-        @param reward       (float): Received reward
-        @param new_state    (list): Newly observed state.
+        @param reward       (float): Received reward, stored as an integer clipped to [-128, 127]
+        @param new_state    (list): Newly observed state. Not stored, it is the state of the next transition
+                                    (at terminal transitions its value is masked out of the target anyway)
+
+        With a GPU buffer, transitions only become available for sampling (and count in mem_counter)
+        once a block of them has been written.
+        """
+
+    def _flush_pending(self) -> None:
+        """!
+        Writes the collected transitions into the memory buffer as one contiguous block.
+        """
+
+        states, actions, rewards, dones = zip(*self._pending)
+        n_pending = len(self._pending)
+
+        # modulus to overwrite old transitions, the block may wrap around the end of the buffer
+        indices = torch.arange(self.mem_counter, self.mem_counter + n_pending) % self.memory_size
+        indices = indices.to(self.replay_device, non_blocking=True)
+
+        with self._buffer_lock:
+            self.state_buffer[indices] = torch.from_numpy(np.stack(states)).to(self.replay_device, non_blocking=True)
+            self.action_buffer[indices] = torch.tensor(actions, dtype=torch.int64).to(self.replay_device, non_blocking=True)
+            self.reward_buffer[indices] = torch.tensor(rewards, dtype=torch.int8).to(self.replay_device, non_blocking=True)
+            self.terminal_buffer[indices] = torch.tensor(dones, dtype=torch.bool).to(self.replay_device, non_blocking=True)
+            self.mem_counter += n_pending
+        self._pending.clear()
+
+
+    def _sample_indices(self, batch_size: int, generator: torch.Generator = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """!
+        Draws random transition indices, consider case memory is not full yet.
+
+        @param batch_size (int): Number of transitions to sample
+        @param generator (torch.Generator): Random generator to draw from, the global one by default
+
+        @return (tuple): indices of the sampled transitions and of their next states
+        """
+
+        max_mem = min(self.mem_counter, self.memory_size)
+
+        # pick batch_size number of random indices on the buffer's device,
+        # skipping the newest transition since its next state is not in the buffer yet
+        offsets = torch.randint(max_mem - 1, (batch_size,), device=self.replay_device, generator=generator)
+        batch_indices = (self.mem_counter + offsets) % max_mem
+        next_indices = (batch_indices + 1) % self.memory_size
+        return batch_indices, next_indices
+
+    def _sample_batch(self, batch_size: int) -> Tuple[torch.Tensor, ...]:
+        """!
+        Samples a mini-batch of transitions from the memory buffer.
+
+        @param batch_size (int): Number of transitions to sample
+
+        @return (tuple): states, actions, rewards, next states and terminal flags on the training device
+        """
+
+        if not self._use_staging:
+            batch_indices, next_indices = self._sample_indices(batch_size)
+            return (
+                self.state_buffer[batch_indices].float(),
+                self.action_buffer[batch_indices], # int64 for indexing
+                self.reward_buffer[batch_indices].float(),
+                self.state_buffer[next_indices].float(),
+                self.terminal_buffer[batch_indices],
+            )
+
+        if self._prefetch_thread is None:
+            self._start_prefetching(batch_size)
+        pinned = self._batch_queue.get()
+        if isinstance(pinned, Exception):
+            self._prefetch_thread = None # the thread has exited, the next call starts a new one
+            raise pinned
+
+        # The copy overlaps with whatever the previous learn() step still has queued on the default stream
+        with torch.cuda.stream(self._copy_stream):
+            batch = [tensor.to(self.device, non_blocking=True) for tensor in pinned]
+        self._copy_stream.synchronize() # staging tensors can be refilled once this returns
+        for tensor in batch:
+            tensor.record_stream(torch.cuda.current_stream()) # allocated on the copy stream, used on the default one
+
+        states, actions, rewards, next_states, terminals = batch
+        return states.float(), actions, rewards.float(), next_states.float(), terminals
+
+    def _start_prefetching(self, batch_size: int) -> None:
+        """!
+        Starts the background thread that gathers mini-batches into pinned memory for _sample_batch.
+
+        @param batch_size (int): Number of transitions per mini-batch
+        """
+
+        # One staging set being filled, two queued and one being copied to the GPU
+        n_slots = self._batch_queue.maxsize + 2
+        state_shape = (batch_size, *self.state_buffer.shape[1:])
+        slots = [
+            (
+                torch.empty(state_shape, dtype=torch.uint8, pin_memory=True),
+                torch.empty(batch_size, dtype=torch.int64, pin_memory=True),
+                torch.empty(batch_size, dtype=torch.int8, pin_memory=True),
+                torch.empty(state_shape, dtype=torch.uint8, pin_memory=True),
+                torch.empty(batch_size, dtype=torch.bool, pin_memory=True),
+            )
+            for _ in range(n_slots)
+        ]
+
+        # The thread draws from its own generator, seeded from the global one. Sampling is still not
+        # reproducible: the indices depend on mem_counter at the time the thread gets scheduled
+        generator = torch.Generator()
+        generator.manual_seed(int(torch.randint(2**62, (1,))))
+
+        self._prefetch_thread = threading.Thread(
+            target=_prefetch_batches,
+            args=(weakref.ref(self), self._batch_queue, slots, generator, batch_size),
+            daemon=True,
+        )
+        self._prefetch_thread.start()
+
+    def _gather_pinned(self, slot: Tuple[torch.Tensor, ...], batch_size: int, generator: torch.Generator) -> None:
+        """!
+        Samples a mini-batch and gathers it straight into a set of pinned staging tensors.
+
+        @param slot (tuple): Pinned states, actions, rewards, next states and terminal flags to fill
+        @param batch_size (int): Number of transitions to sample
+        @param generator (torch.Generator): Random generator to draw the indices from
         """
 
+        states, actions, rewards, next_states, terminals = slot
+        with self._buffer_lock:
+            batch_indices, next_indices = self._sample_indices(batch_size, generator)
+            torch.index_select(self.state_buffer, 0, batch_indices, out=states)
+            torch.index_select(self.action_buffer, 0, batch_indices, out=actions)
+            torch.index_select(self.reward_buffer, 0, batch_indices, out=rewards)
+            torch.index_select(self.state_buffer, 0, next_indices, out=next_states)
+            torch.index_select(self.terminal_buffer, 0, batch_indices, out=terminals)
+
+
+    def _run_train_step(self, *batch: torch.Tensor) -> None:
+        """!
+        Runs _train_step on a sampled mini-batch. On GPU the step is captured into a CUDA graph after
+        a few warm-up steps and then replayed, so forward, backward and optimizer step are launched at once.
+        The target networks are updated in place, so the captured graph stays valid.
+
+        @param batch (torch.Tensor): states, actions, rewards, next states and terminal flags
+        """
+
+        if self.device.type != "cuda":
+            self._train_step(*batch)
+            return
+
+        if self._graph_inputs is None:
+            self._graph_inputs = [tensor.clone() for tensor in batch]
+        else:
+            for static_input, tensor in zip(self._graph_inputs, batch):
+                static_input.copy_(tensor, non_blocking=True)
+
+        if self._graph is not None:
+            self._graph.replay()
+            return
+
+        # Warm up on a side stream before capturing, this also lets torch.compile finish compiling
+        if self._graph_warmup_steps < 3:
+            warmup_stream = torch.cuda.Stream()
+            warmup_stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(warmup_stream):
+                self._train_step(*self._graph_inputs)
+            torch.cuda.current_stream().wait_stream(warmup_stream)
+            self._graph_warmup_steps += 1
+            return
+
+        # Capturing records the kernels without running them, so replay once for this step
+        self._graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self._graph):
+            self._train_step(*self._graph_inputs)
+        self._graph.replay()
+
+    def _train_step(
+        self,
+        states: torch.Tensor,
+        actions: torch.Tensor,
+        rewards: torch.Tensor,
+        next_states: torch.Tensor,
+        terminals: torch.Tensor
+    ) -> None:
+        """!
+        One gradient update of the internal networks on a mini-batch.
+        Must only launch tensor operations on its inputs (no Python-side state changes), so it can be
+        captured into a CUDA graph.
+        """
+
+        for optimizer in self.optimizers:
+            optimizer.zero_grad(set_to_none=True) # Reset gradients before backpropagation
+
+        loss = self._compute_loss(states, actions, rewards, next_states, terminals)
+
+        # Backpropagate, each optimizer only steps the parameters of its own network
+        loss.backward()
+        for optimizer in self.optimizers:
+            optimizer.step()
 
     @abstractmethod
-    def choose_action(
+    def _compute_loss(
         self,
-        observation: np.ndarray
-    ) -> int: 
+        states: torch.Tensor,
+        actions: torch.Tensor,
+        rewards: torch.Tensor,
+        next_states: torch.Tensor,
+        terminals: torch.Tensor
+    ) -> torch.Tensor:
         """!
         Abstract method that should be implemented by the child class, e.g. DQN or DDQN agents.
-        This method should contain the full logic needed to choose an action based on the current state.
-        Maybe you can store the neural network in the agent class and use it here to decide which action to take?
-
-        @param observation (np.ndarray): Vector describing current state
+        Computes the TD loss of the mini-batch, summed over all trained networks.
 
-        @return (int): Action to take
+        @return (torch.Tensor): Scalar loss
         """
 
-        return 0
+        pass
 
     @abstractmethod
-    def learn(self) -> None:
+    def _update_target_networks(self) -> None:
         """!
-        Update the parameters of the internal networks.
-        This method should be implemented by the child class.
+        Abstract method that should be implemented by the child class.
+        Syncs the target networks, called every target_update_frequency learn steps.
         """
 
         pass
-class DQNAgent(Agent):
-    def __init__(
-        self,
-        memory_size: int,
-        state_dimensions: Tuple[int, int, int], # (height, width, fps)
-        n_actions: int,
-        q_network_class,        
-        **kwargs
-         ):
-        super(DQNAgent, self).__init__(memory_size, state_dimensions,  n_actions)
-        self.lr = kwargs.get("learning_rate", 0.0001)
-        self.gamma = kwargs.get("gamma", 0.99)
-        self.epsilon = kwargs.get("epsilon_start", 1.0)
-        self.epsilon_min = kwargs.get("epsilon_min", 0.0001)
-        self.epsilon_decay = kwargs.get("epsilon_decay", 0.986)
-        self.batch_size = kwargs.get("batch_size", 32)
-        self.target_update_frequency = kwargs.get("target_update_frequency", 1000)
-        self.burn_in_period = kwargs.get("burn_in_period", 7000)
 
-        self.learn_step_counter = 0 # For target network updates
+    def _make_epsilon_schedule(self) -> np.ndarray:
+        """!
+        Precomputes epsilon after each learn step, epsilon_start * epsilon_decay^step clamped at epsilon_min.
+        The schedule ends at the first step reaching epsilon_min, or after epsilon_schedule_steps steps,
+        later steps fall back to _decay_epsilon.
 
-        # Input_dims for QNetwork is (84, 84, FPS) 
-        self.q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)
-        self.q_target_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)  
-        self.q_target_network.load_state_dict(self.q_network.state_dict()) # Initialize target with eval weights with parameter tensor state_dict
-        self.q_target_network.eval() # Put target network in eval mode
+        @return (np.ndarray): Epsilon indexed by learn_step_counter
+        """
 
-        self.optimizer = optim.Adam(self.q_network.parameters(), lr=self.lr)
-        self.loss_fn = nn.MSELoss()
+        start, decay, minimum = self.cfg.epsilon_start, self.cfg.epsilon_decay, self.cfg.epsilon_min
+        if start <= minimum or not 0 < decay < 1: # clamped from the first step, or constant
+            n_steps = 1
+        elif minimum <= 0: # never clamped
+            n_steps = self.epsilon_schedule_steps
+        else:
+            n_steps = min(math.ceil(math.log(minimum / start) / math.log(decay)) + 1, self.epsilon_schedule_steps)
 
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.q_network.to(self.device)
-        self.q_target_network.to(self.device)   
+        # Running product, the same float multiplications as decaying epsilon step by step
+        factors = np.full(n_steps, decay)
+        factors[0] = start
+        return np.maximum(minimum, np.cumprod(factors))
 
-    def choose_action(self, observation: np.ndarray) -> int:
-        ''' choose action, 
-        input state (84,84,4) from environment 
-        output action
-        
-        '''
+    def _prepare_network(self, network: torch.nn.Module) -> torch.nn.Module:
+        """!
+        Moves the q_network to the training device and compiles it for the per-step forward in choose_action.
+        learn() traces through the compiled module in the compiled losses. The other networks are only called
+        inside the compiled losses, so they stay plain modules.
+        """
 
+        return torch.compile(network.to(self.device), mode="reduce-overhead")
+
+    def _make_optimizer(self, network: torch.nn.Module) -> optim.Optimizer:
+        """!
+        Adam optimizer for a network, capturable on GPU so the train step can be captured in a CUDA graph.
+        """
+
+        return optim.Adam(network.parameters(), lr=self.cfg.learning_rate, capturable=self.device.type == "cuda")
+
+    @staticmethod
+    @torch.no_grad()
+    def _sync_target(target: torch.nn.Module, source: torch.nn.Module, weight: float = None) -> None:
+        """!
+        Copies the source parameters into the target network in place, with multi-tensor kernels
+        instead of one launch per parameter. In place so a captured CUDA graph stays valid.
+
+        @param target (torch.nn.Module): Target network to update
+        @param source (torch.nn.Module): Online network to copy from
+        @param weight (float): Soft update weight of the source, None for a hard copy
+        """
+
+        tgt = list(target.parameters())
+        src = list(source.parameters())
+        if weight is None:
+            torch._foreach_copy_(tgt, src)
+        else:
+            torch._foreach_mul_(tgt, 1 - weight)
+            torch._foreach_add_(tgt, src, alpha=weight)
+
+    def choose_action(
+        self,
+        observation: np.ndarray
+    ) -> int: 
+        """!
+        Chooses an epsilon-greedy action with the child class' q_network.
+
+        @param observation (np.ndarray): Vector describing current state, shape (84, 84, 4)
+
+        @return (int): Action to take
+        """
 
         # with chance epsilon we explore
         if np.random.rand() <= self.epsilon:
-            return np.random.choice(self.n_actions)
-        
+            return np.random.randint(self.n_actions)
+
         # else we exploit
-        else:
-            # Convert observation to PyTorch tensor and add batch dimension in first dim with unsqueeze(0)
-            # Neural net excpects input of shape (batch_size, channels, height, width)
-            state = torch.tensor(observation, dtype=torch.float32).unsqueeze(0).to(self.device)
+        # Copy observation into the (1, height, width, channels) input tensor, the batch dimension is already there
+        # Same uint8 quantization as the replay buffer
+        self._obs_scratch.copy_(torch.from_numpy(np.rint(observation).astype(np.uint8)))
 
-            self.q_network.eval() # Set q network to evaluation mode
-            with torch.no_grad(): 
-                q_values = self.q_network(state) #compute q values for current state
-            self.q_network.train() # Set network back to train mode
+        # No eval()/train() switch, the networks have no dropout or batch norm
+        with torch.no_grad():
+            q_values = self.q_network(self._obs_scratch) #compute q values for current state
 
-            return torch.argmax(q_values).item() 
-        
+        return torch.argmax(q_values).item()
+
+    def choose_actions_batch(
+        self,
+        observations: np.ndarray
+    ) -> np.ndarray:
+        """!
+        Epsilon-greedy actions for a batch of observations, e.g. from vectorized environments.
+        Runs one forward pass of the child class' q_network over the whole batch and draws the
+        exploration mask on the device, so there is a single device -> host transfer at the end.
+
+        @param observations (np.ndarray): States of shape (batch_size, height, width, channels)
+
+        @return (np.ndarray): Action to take for every observation, shape (batch_size,)
+        """
+
+        # Same uint8 quantization as the replay buffer
+        states = torch.from_numpy(np.rint(observations).astype(np.uint8)).to(self.device, non_blocking=True).float()
+        batch_size = states.shape[0]
+
+        with torch.no_grad():
+            greedy_actions = torch.argmax(self.q_network(states), dim=1)
+        explore = torch.rand(batch_size, device=self.device) <= self.epsilon
+        random_actions = torch.randint(self.n_actions, (batch_size,), device=self.device)
+
+        return torch.where(explore, random_actions, greedy_actions).cpu().numpy()
 
     def learn(self) -> None:
-        if self.mem_counter < self.burn_in_period: # Not enough samples yet
-            return  
+        """!
+        Update the parameters of the internal networks on one sampled mini-batch,
+        then sync the target networks when due and decay epsilon.
+        """
 
-        self.optimizer.zero_grad() 
+        if self.mem_counter < self.cfg.burn_in_period: # Not enough samples yet
+            return
 
-        # Sample a mini-batch from memory, consider case memory is not full yet
-        max_mem = min(self.mem_counter, self.memory_size)
+        self._run_train_step(*self._sample_batch(self.cfg.batch_size))
+        self.learn_step_counter += 1
 
-        # pick batch_size number of random indices without replacement
-        batch_indices = np.random.choice(max_mem, self.batch_size, replace=False)  
+        # If we reached the target update frequency, update the target network
+        if self.learn_step_counter % self.cfg.target_update_frequency == 0:
+            self._update_target_networks()
 
-        states_batch = torch.tensor(self.state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        actions_batch = torch.tensor(self.action_buffer[batch_indices], dtype=torch.long).to(self.device) # .long() for indexing
-        rewards_batch = torch.tensor(self.reward_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        new_states_batch = torch.tensor(self.next_state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        terminal_batch = torch.tensor(self.terminal_buffer[batch_indices], dtype=torch.bool).to(self.device)
+        # Epsilon decay, looked up in the precomputed schedule while it lasts
+        if self.learn_step_counter < len(self._epsilon_schedule):
+            self.epsilon = float(self._epsilon_schedule[self.learn_step_counter])
+        else:
+            self._decay_epsilon()
 
-        q_s = self.q_network(states_batch) # Shape: (batch_size, n_actions)
+    def _decay_epsilon(self) -> None:
+        """!
+        Decays epsilon by epsilon_decay after a learn step, clamped at epsilon_min.
+        """
 
-        # Gather Q-values corresponding to the actions taken
-        q_action_taken = q_s.gather(1, actions_batch.unsqueeze(1)).squeeze(1) 
+        self.epsilon = max(self.epsilon * self.cfg.epsilon_decay, self.cfg.epsilon_min)
 
+class DQNAgent(Agent):
+    def __init__(
+        self,
+        memory_size: int,
+        state_dimensions: Tuple[int, int, int], # (height, width, fps)
+        n_actions: int,
+        q_network_class,        
+        **kwargs
+         ):
+        super(DQNAgent, self).__init__(memory_size, state_dimensions, n_actions, **kwargs)
 
-        # Get Q-values for next states from q_target_network
-        q_next = self.q_target_network(new_states_batch) # Shape: (batch_size, n_actions)
-        q_next[terminal_batch] = 0.0 # Q-value of terminal state is 0
+        # Input_dims for QNetwork is (84, 84, FPS) 
+        self.q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)
+        self.q_target_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)  
+        self.q_target_network.load_state_dict(self.q_network.state_dict()) # Initialize target with eval weights with parameter tensor state_dict
+        self.q_target_network.eval() # Put target network in eval mode
 
-        # Calculate target Q-values
-        #  For DQN, target is R + gamma * max_a'(Q_target(s', a'))
-        q_target = rewards_batch + self.gamma * torch.max(q_next, dim=1)[0] # [0] to get values from (values, indices) tuple
+        self.q_network = self._prepare_network(self.q_network)
+        self.q_target_network.to(self.device)
 
-        # Calculate loss
-        loss = self.loss_fn(q_action_taken, q_target)
+        self.optimizer = self._make_optimizer(self.q_network)
+        self.optimizers = [self.optimizer]
 
-        # Backpropagate
-        loss.backward()
-        self.optimizer.step()
+    def _compute_loss(self, states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch) -> torch.Tensor:
+        return _dqn_loss(self.q_network, self.q_target_network,
+                         states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch, self.cfg.gamma)
 
-        self.learn_step_counter += 1
+    def _update_target_networks(self) -> None:
+        self._sync_target(self.q_target_network, self.q_network)
 
-        # If we reached the target update frequency, update the target network
-        if self.learn_step_counter % self.target_update_frequency == 0:
-            self.q_target_network.load_state_dict(self.q_network.state_dict())
+    def _decay_epsilon(self) -> None:
+        # Only clamped once epsilon is at or below epsilon_min, so it dips under it for one step
+        self.epsilon = self.epsilon * self.cfg.epsilon_decay if self.epsilon > self.cfg.epsilon_min else self.cfg.epsilon_min
+
+    def _make_epsilon_schedule(self) -> np.ndarray:
+        # Same dip as _decay_epsilon: the first value at or below epsilon_min is kept unclamped for one step
+        schedule = super(DQNAgent, self)._make_epsilon_schedule()
+        clamped = np.flatnonzero(schedule <= self.cfg.epsilon_min)
+        if len(clamped) > 0 and clamped[0] > 0:
+            schedule[clamped[0]] = schedule[clamped[0] - 1] * self.cfg.epsilon_decay
+        return schedule
 
-        # Epsilon decay
-        self.epsilon = self.epsilon * self.epsilon_decay if self.epsilon > self.epsilon_min else self.epsilon_min
 class DDQNAgent(Agent):
     def __init__(
         self,
@@ -209,115 +666,42 @@ class DDQNAgent(Agent):
         soft_update: bool = False,  #whether to use soft update or hard update
         **kwargs 
         ):
-        super(DDQNAgent, self).__init__(memory_size, state_dimensions,  n_actions)
-        self.lr = kwargs.get("learning_rate", 0.0001)
-        self.gamma = kwargs.get("gamma", 0.99)
-        self.epsilon = kwargs.get("epsilon_start", 1.0)
-        self.epsilon_min = kwargs.get("epsilon_min", 0.0001)
-        self.epsilon_decay = kwargs.get("epsilon_decay", 0.986)
-        self.batch_size = kwargs.get("batch_size", 32)
-        self.target_update_frequency = kwargs.get("target_update_frequency", 1000)
-        self.burn_in_period = kwargs.get("burn_in_period", 7000)
-
-        self.learn_step_counter = 0 # For target network updates
+        super(DDQNAgent, self).__init__(memory_size, state_dimensions, n_actions, **kwargs)
         self.t_weight = t_weight_start
         self.soft_update = soft_update
 
-
         self.q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)
         self.q_target_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions) 
         self.q_target_network.eval() # Put target network in eval mode
 
-        self.optimizer = optim.Adam(self.q_network.parameters(), lr=self.lr)
-        self.loss_fn = nn.MSELoss()
-
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.q_network.to(self.device)
-        self.q_target_network.to(self.device)   
+        self.q_network = self._prepare_network(self.q_network)
+        self.q_target_network.to(self.device)
 
+        self.optimizer = self._make_optimizer(self.q_network)
+        self.optimizers = [self.optimizer]
 
-    def choose_action(self, observation: np.ndarray) -> int:
-        ''' choose action, 
-        input state (84,84,4) from environment 
-        output action
-        
-        '''
+    def _compute_loss(self, states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch) -> torch.Tensor:
+        return _ddqn_loss(self.q_network, self.q_target_network,
+                          states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch, self.cfg.gamma)
 
-
-        # with chance epsilon we explore
-        if np.random.rand() <= self.epsilon:
-            return np.random.choice(self.n_actions)
-        
-        # else we exploit
+    def _update_target_networks(self) -> None:
+        # soft update
+        if self.soft_update == True:
+            self._sync_target(self.q_target_network, self.q_network, self.t_weight)
+        # hard update
         else:
-            # Convert observation to PyTorch tensor and add batch dimension in first dim with unsqueeze(0)
-            # Neural net excpects input of shape (batch_size, channels, height, width)
-            state = torch.tensor(observation, dtype=torch.float32).unsqueeze(0).to(self.device)
-
-            self.q_network.eval() # Set q network to evaluation mode, is it necessary?
-            with torch.no_grad(): 
-                q_values = self.q_network(state) #comput q values for current state
-            self.q_network.train() # Set network back to train mode
-
-            return torch.argmax(q_values).item() 
-        
-
-    def learn(self) -> None:
-        if self.mem_counter < self.burn_in_period: # Not enough samples yet
-            return  
-
-        self.optimizer.zero_grad() # Reset gradients before backpropagation
-
-        # Sample a mini-batch from memory, consider case memory is not full yet
-        max_mem = min(self.mem_counter, self.memory_size)
-
-        # pick batch_size number of random indices without replacement
-        batch_indices = np.random.choice(max_mem, self.batch_size, replace=False)  
-
-        states_batch = torch.tensor(self.state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        actions_batch = torch.tensor(self.action_buffer[batch_indices], dtype=torch.long).to(self.device) # .long() for indexing
-        rewards_batch = torch.tensor(self.reward_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        new_states_batch = torch.tensor(self.next_state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        terminal_batch = torch.tensor(self.terminal_buffer[batch_indices], dtype=torch.bool).to(self.device)
-
-        q_s = self.q_network(states_batch) # Shape: (batch_size, n_actions)
-        # Gather Q-values corresponding to the actions taken
-        q_action_taken = q_s.gather(1, actions_batch.unsqueeze(1)).squeeze(1) 
-
-
-        q_snext= self.q_network(new_states_batch) # next state q values
-        q_snext[terminal_batch] = 0.0 # Q-value of terminal state is 0
-        q_actions_batch= torch.argmax(q_snext,dim=1) #argmax actions in next state
-
-        with torch.no_grad():
-            target_q_snext= self.q_target_network(new_states_batch) # shape (batch_size, n_actions)
-            target_q_snext[terminal_batch] = 0.0 
-            # action target for double dqn
-            q_action_target= target_q_snext.gather(1, q_actions_batch.unsqueeze(1)).squeeze(1) 
-
-        target = rewards_batch + self.gamma*q_action_target # [0] to get values from (values, indices) tuple
-
-        # Calculate loss
-        loss = self.loss_fn(q_action_taken, target)
-
-        # Backpropagate
-        loss.backward()
-        self.optimizer.step()
-        self.learn_step_counter += 1
-
-        # If we reached the target update frequency, update the target network
-        if self.learn_step_counter % self.target_update_frequency == 0:
-            # soft update
-            if self.soft_update == True:
-                for target_param, param in zip(self.q_target_network.parameters(), self.q_network.parameters()):
-                    target_param.data.copy_(self.t_weight * param.data + (1 - self.t_weight) * target_param.data)
-            # hard update
-            else:
-                self.q_target_network.load_state_dict(self.q_network.state_dict())
-            # Epsilon decay
-        self.epsilon = max(self.epsilon * self.epsilon_decay,self.epsilon_min)
+            self._sync_target(self.q_target_network, self.q_network)
 
 class DQVAgent(Agent): 
+    config_defaults = dict(
+        learning_rate=0.00025,
+        epsilon_start=1.0, # Paper uses 0.5 for DQV/DQV-Max
+        epsilon_min=0.001,
+        epsilon_decay=0.9998,
+        target_update_frequency=2000,
+        burn_in_period=7000, # As per paper's N_cal
+    )
+
     def __init__(
         self,
         memory_size: int,
@@ -327,17 +711,7 @@ class DQVAgent(Agent):
         v_network_class, 
         **kwargs
     ):
-        super(DQVAgent, self).__init__(memory_size, state_dimensions, n_actions)
-        self.lr = kwargs.get("learning_rate", 0.00025)
-        self.gamma = kwargs.get("gamma", 0.99)
-        self.epsilon = kwargs.get("epsilon_start", 1.0) # Paper uses 0.5 for DQV/DQV-Max
-        self.epsilon_min = kwargs.get("epsilon_min", 0.001)
-        self.epsilon_decay = kwargs.get("epsilon_decay", 0.9998) 
-        self.batch_size = kwargs.get("batch_size", 32)
-        self.target_update_frequency = kwargs.get("target_update_frequency", 2000) 
-        self.burn_in_period = kwargs.get("burn_in_period", 7000) # As per paper's N_cal
-
-        self.learn_step_counter = 0
+        super(DQVAgent, self).__init__(memory_size, state_dimensions, n_actions, **kwargs)
 
         self.q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)
         self.v_network = v_network_class(input_dims=state_dimensions)
@@ -346,70 +720,30 @@ class DQVAgent(Agent):
         self.target_v_network.load_state_dict(self.v_network.state_dict())
         self.target_v_network.eval()
 
-        self.q_optimizer = optim.Adam(self.q_network.parameters(), lr=self.lr)
-        self.v_optimizer = optim.Adam(self.v_network.parameters(), lr=self.lr)
-        self.loss_fn = nn.MSELoss()
-
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.q_network.to(self.device)
+        self.q_network = self._prepare_network(self.q_network)
         self.v_network.to(self.device)
         self.target_v_network.to(self.device)
 
-    def choose_action(self, observation: np.ndarray) -> int:
-        if np.random.rand() <= self.epsilon:
-            return np.random.choice(self.n_actions)
-        else:
-            state = torch.tensor(observation, dtype=torch.float32).unsqueeze(0).to(self.device)
-            self.q_network.eval()
-            with torch.no_grad():
-                q_values = self.q_network(state)
-            self.q_network.train()
-            return torch.argmax(q_values).item()
+        self.q_optimizer = self._make_optimizer(self.q_network)
+        self.v_optimizer = self._make_optimizer(self.v_network)
+        self.optimizers = [self.v_optimizer, self.q_optimizer]
 
-    def learn(self) -> None:
-        if self.mem_counter < self.burn_in_period:
-            return
-
-        self.q_optimizer.zero_grad()
-        self.v_optimizer.zero_grad()
-
-        max_mem = min(self.mem_counter, self.memory_size)
-        batch_indices = np.random.choice(max_mem, self.batch_size, replace=False)
+    def _compute_loss(self, states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch) -> torch.Tensor:
+        return _dqv_loss(self.q_network, self.v_network, self.target_v_network,
+                         states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch, self.cfg.gamma)
 
-        states_batch = torch.tensor(self.state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        actions_batch = torch.tensor(self.action_buffer[batch_indices], dtype=torch.long).to(self.device)
-        rewards_batch = torch.tensor(self.reward_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        new_states_batch = torch.tensor(self.next_state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        terminal_batch = torch.tensor(self.terminal_buffer[batch_indices], dtype=torch.bool).to(self.device)
-
-        # Calculate TD target for both V and Q networks 
-        # target^DQV = r_t + gamma * V(s_{t+1}; Phi^-)
-        with torch.no_grad():
-            v_s_next_target = self.target_v_network(new_states_batch).squeeze()
-            v_s_next_target[terminal_batch] = 0.0
-            target_dqv = rewards_batch + self.gamma * v_s_next_target
-
-        # --- Update V-Network ---
-        v_s = self.v_network(states_batch).squeeze()
-        v_loss = self.loss_fn(target_dqv, v_s)
-        v_loss.backward()
-        self.v_optimizer.step()
-
-        # --- Update Q-Network ---
-        q_s= self.q_network(states_batch)
-        q_action_taken = q_s.gather(1, actions_batch.unsqueeze(-1)).squeeze(-1)
-        q_loss = self.loss_fn(target_dqv, q_action_taken)
-        q_loss.backward()
-        self.q_optimizer.step()
-
-        self.learn_step_counter += 1
-
-        if self.learn_step_counter % self.target_update_frequency == 0:
-            self.target_v_network.load_state_dict(self.v_network.state_dict()) 
-
-        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+    def _update_target_networks(self) -> None:
+        self._sync_target(self.target_v_network, self.v_network)
 
 class DQVMaxAgent(Agent):
+    config_defaults = dict(
+        learning_rate=0.00025,
+        epsilon_start=0.5,
+        epsilon_min=0.001,
+        epsilon_decay=0.9998,
+        target_update_frequency=200,
+    )
+
     def __init__(
         self,
         memory_size: int,
@@ -419,91 +753,29 @@ class DQVMaxAgent(Agent):
         v_network_class, 
         **kwargs
     ):
-        super(DQVMaxAgent, self).__init__(memory_size, state_dimensions, n_actions)
-        self.lr = kwargs.get("learning_rate", 0.00025) 
-        self.gamma = kwargs.get("gamma", 0.99)
-        self.epsilon = kwargs.get("epsilon_start", 0.5) 
-        self.epsilon_min = kwargs.get("epsilon_min", 0.001) 
-        self.epsilon_decay = kwargs.get("epsilon_decay", 0.9998)
-        self.batch_size = kwargs.get("batch_size", 32)
-        self.target_update_frequency = kwargs.get("target_update_frequency", 200) 
-        self.burn_in_period = kwargs.get("burn_in_period", 7000) 
-
-        self.learn_step_counter = 0
-
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        super(DQVMaxAgent, self).__init__(memory_size, state_dimensions, n_actions, **kwargs)
 
         # Initialize Q-Network and Target Q-Network
-        self.q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions).to(self.device)
-        self.target_q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions).to(self.device)
+        self.q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)
+        self.target_q_network = q_network_class(input_dims=state_dimensions, n_actions=n_actions)
         self.target_q_network.load_state_dict(self.q_network.state_dict())
         self.target_q_network.eval() # Target network is only for inference
 
         # Initialize V-Network
-        self.v_network = v_network_class(input_dims=state_dimensions).to(self.device)
-
-
-        self.q_optimizer = optim.Adam(self.q_network.parameters(), lr=self.lr)
-        self.v_optimizer = optim.Adam(self.v_network.parameters(), lr=self.lr)
-        self.loss_fn = nn.MSELoss()
-
-
-    def choose_action(self, observation: np.ndarray) -> int:
-        if np.random.rand() <= self.epsilon:
-            return np.random.choice(self.n_actions)
-        else:
-            state = torch.tensor(observation, dtype=torch.float32).unsqueeze(0).to(self.device)
-            self.q_network.eval() 
-            with torch.no_grad():
-                q_values = self.q_network(state)
-            self.q_network.train() 
-            return torch.argmax(q_values).item()
-
-    def learn(self) -> None:
-        if self.mem_counter < self.burn_in_period: 
-            return
-
-        self.q_optimizer.zero_grad()
-        self.v_optimizer.zero_grad()
-
-        max_mem = min(self.mem_counter, self.memory_size)
-        batch_indices = np.random.choice(max_mem, self.batch_size, replace=False)
-
-        states_batch = torch.tensor(self.state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        actions_batch = torch.tensor(self.action_buffer[batch_indices], dtype=torch.long).to(self.device)
-        rewards_batch = torch.tensor(self.reward_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        new_states_batch = torch.tensor(self.next_state_buffer[batch_indices], dtype=torch.float32).to(self.device)
-        terminal_batch = torch.tensor(self.terminal_buffer[batch_indices], dtype=torch.bool).to(self.device)
-
-        # --- Update V-Network ---
-        # Target for V-network = r_t + gamma * max_a' Q(s_{t+1}, a'; theta^-)
-        with torch.no_grad():
-            q_next_target = self.target_q_network(new_states_batch) 
-            max_q_next_target = torch.max(q_next_target, dim=1)[0]
-            max_q_next_target[terminal_batch] = 0.0 
-            v_target = rewards_batch + self.gamma * max_q_next_target
-        
-        v_s = self.v_network(states_batch).squeeze() 
-        v_loss = self.loss_fn(v_target, v_s)
-        v_loss.backward() 
-        self.v_optimizer.step() 
+        self.v_network = v_network_class(input_dims=state_dimensions)
 
-        # --- Update Q-Network ---
-        # Target for Q-network = r_t + gamma * V(s_{t+1}; Phi)
-        with torch.no_grad():
-            v_s_next = self.v_network(new_states_batch).squeeze() 
-            v_s_next[terminal_batch] = 0.0 
-            q_target = rewards_batch + self.gamma * v_s_next
-        
-        q_s = self.q_network(states_batch) 
-        q_action_taken = q_s.gather(1, actions_batch.unsqueeze(-1)).squeeze(-1) 
-        q_loss = self.loss_fn(q_target, q_action_taken)
-        q_loss.backward() 
-        self.q_optimizer.step() 
+        self.q_network = self._prepare_network(self.q_network)
+        self.target_q_network.to(self.device)
+        self.v_network.to(self.device)
 
-        self.learn_step_counter += 1
+        self.q_optimizer = self._make_optimizer(self.q_network)
+        self.v_optimizer = self._make_optimizer(self.v_network)
+        self.optimizers = [self.v_optimizer, self.q_optimizer]
 
-        if self.learn_step_counter % self.target_update_frequency == 0:
-            self.target_q_network.load_state_dict(self.q_network.state_dict())
+    def _compute_loss(self, states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch) -> torch.Tensor:
+        # Both targets come from the networks before this step's update, so V and Q train in one backward pass
+        return _dqv_max_loss(self.q_network, self.v_network, self.target_q_network,
+                             states_batch, actions_batch, rewards_batch, new_states_batch, terminal_batch, self.cfg.gamma)
 
-        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+    def _update_target_networks(self) -> None:
+        self._sync_target(self.target_q_network, self.q_network)
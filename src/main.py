@@ -23,10 +23,12 @@ def run_environment(seed_value, config,agent_class,network_args):
     torch.manual_seed(seed_value)
 
     #Make sure torch calculation are deterministic, slightly slows down training
+    #cuDNN autotuning from agent.py is opt-in: it only stays enabled with "deterministic": false in the config
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(seed_value) 
-        torch.backends.cudnn.deterministic = True
-        torch.backends.cudnn.benchmark = False
+        if config.get("deterministic", True):
+            torch.backends.cudnn.deterministic = True
+            torch.backends.cudnn.benchmark = False
 
     env = CatchEnv()
     state_dimensions = env.observation_space.shape
@@ -43,7 +45,7 @@ def run_environment(seed_value, config,agent_class,network_args):
    
     print(f"--- Running Training for Seed: {seed_value} ---")
     print(f"Agent type: {config['agent_type']}")
-    print(f"Learning rate: {agent.lr}") 
+    print(f"Learning rate: {agent.cfg.learning_rate}") 
     print(f"Using device: {agent.device}") 
     print(f"State dimensions: {state_dimensions}")
     print(f"Number of actions: {n_actions}")
@@ -200,7 +202,7 @@ if __name__ == "__main__":
     "std_moving_average_scores": std_ma_scores.tolist(),
     "mean_cumulative_rewards": mean_cumulative_rewards.tolist(),
     "std_cumulative_rewards": std_cumulative_rewards.tolist(),
-    "all_seeds": SEEDS
+    "all_seeds": SEEDS,
     "run_time": run_time,
     }
 